@@ -9,7 +9,7 @@ O que este script faz
    Isso evita reenvio caso o arquivo já esteja no destino (inclusive já "processado").
 
 2) Conecta no SFTP de ORIGEM (cliente1) e lista arquivos de HOJE (D0) dentro de CLIENTE1_REMOTE_DIR,
-   percorrendo subpastas recursivamente.
+   percorrendo subpastas recursivamente; cada arquivo já segue para as etapas 3-4 enquanto a listagem continua.
 
 3) Para cada arquivo de HOJE na origem:
    - Calcula o caminho relativo em relação a CLIENTE1_REMOTE_DIR.
@@ -19,8 +19,10 @@ O que este script faz
      * Se não existir: envia como novo.
 
 4) Fluxo de transferência:
-   - Download origem -> pasta local temporária (CARGAS/cliente1/...)
-   - Upload para destino, criando diretórios remotos se necessário.
+   - Origem -> destino em streaming (sem gravar em disco local): o download alimenta
+     diretamente o upload, criando diretórios remotos se necessário.
+   - Os arquivos são processados em paralelo (SFTP_PARALLELISM), cada thread reutilizando
+     conexões persistentes com a origem e o destino.
 
 5) Gera log local e envia o log para PREAMBULO_REMOTE_LOG_DIR ao final.
 
@@ -38,59 +40,34 @@ from __future__ import annotations
 
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, time, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
-
-import pysftp
-
-
-def load_env_file(env_path: Path) -> None:
-    """Carrega um arquivo .env simples (KEY=VALUE) para os.environ (sem sobrescrever valores já setados)."""
-    if not env_path.exists():
-        return
-    for raw in env_path.read_text(encoding="utf-8").splitlines():
-        line = raw.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-        k, v = line.split("=", 1)
-        k = k.strip()
-        v = v.strip().strip('"').strip("'")
-        os.environ.setdefault(k, v)
-
-
-def getenv_required(name: str) -> str:
-    v = os.getenv(name, "").strip()
-    if not v:
-        raise RuntimeError(f"Variável obrigatória ausente: {name}")
-    return v
-
-
-def getenv_int(name: str, default: int) -> int:
-    raw = os.getenv(name, "").strip()
-    if not raw:
-        return default
-    try:
-        return int(raw)
-    except ValueError:
-        raise RuntimeError(f"Variável inválida (esperado inteiro): {name}={raw!r}")
-
-
-def getenv_bool(name: str, default: bool = False) -> bool:
-    raw = os.getenv(name, "").strip().lower()
-    if not raw:
-        return default
-    return raw in ("1", "true", "yes", "y", "on")
-
-
-@dataclass(frozen=True)
-class SFTPConfig:
-    host: str
-    port: int
-    username: str
-    password: str
-    remote_dir: str
+from typing import Any, Callable, Dict, Set
+
+from sftp_comum import (
+    INTERVALO_PROGRESSO,
+    TAMANHO_CACHE_DESTINO,
+    ErroLeituraOrigem,
+    PoolSFTP,
+    SFTPConfig,
+    StatusContador,
+    aplicar_criptografia_rapida,
+    build_cnopts,
+    configurar_logs,
+    consultar_destino,
+    conteudo_divergente,
+    ensure_remote_dirs,
+    getenv_bool,
+    getenv_int,
+    getenv_required,
+    listar_arquivos_sftp_recursivo,
+    load_env_file,
+    percorrer_arquivos_sftp,
+    transferir_arquivo,
+)
 
 
 @dataclass(frozen=True)
@@ -103,103 +80,19 @@ class cliente1JobConfig:
     destino_log_dir: str
 
     base_dir: Path
-    temp_dir: Path
     log_path: Path
     log_filename: str
 
     disable_hostkey_check: bool
     known_hosts_path: str | None
 
-
-class StatusContador:
-    def __init__(self) -> None:
-        self.novos = 0
-        self.iguais = 0
-        self.reenviados = 0
-        self.erros_download = 0
-        self.erros_upload = 0
-        self.erros_remocao = 0
-
-    def log_resumo(self) -> None:
-        logging.info("--- Resumo Final ---")
-        logging.info("Arquivos novos enviados: %s", self.novos)
-        logging.info("Arquivos iguais pulados: %s", self.iguais)
-        logging.info("Arquivos reenviados (substituídos): %s", self.reenviados)
-        logging.info("Erros ao baixar: %s", self.erros_download)
-        logging.info("Erros ao enviar: %s", self.erros_upload)
-        logging.info("Erros ao remover: %s", self.erros_remocao)
-
-
-def build_cnopts(disable_hostkey_check: bool, known_hosts_path: str | None) -> pysftp.CnOpts:
-    cnopts = pysftp.CnOpts()
-    if disable_hostkey_check:
-        cnopts.hostkeys = None
-        return cnopts
-
-    if known_hosts_path:
-        p = Path(known_hosts_path)
-        if not p.exists():
-            raise RuntimeError(f"SFTP_KNOWN_HOSTS não encontrado: {known_hosts_path}")
-        cnopts.hostkeys.load(str(p))
-    return cnopts
-
-
-def configurar_logs(log_path: Path) -> None:
-    log_path.parent.mkdir(parents=True, exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(str(log_path), encoding="utf-8"),
-            logging.StreamHandler(),
-        ],
-    )
-
-
-def listar_arquivos_sftp_recursivo(
-    sftp: pysftp.Connection,
-    remote_dir: str,
-    *,
-    filtro_data: datetime.date | None = None,
-) -> Dict[str, Dict[str, Any]]:
-    """
-    Lista arquivos recursivamente a partir de `remote_dir`.
-
-    Retorna dict: { caminho_remoto: {'tamanho': int, 'data': date} }
-
-    Se `filtro_data` for informado, inclui apenas arquivos cuja data de modificação == filtro_data.
-    """
-    arquivos: Dict[str, Dict[str, Any]] = {}
-    try:
-        entries = sftp.listdir_attr(remote_dir)
-        for entry in entries:
-            nome = entry.filename
-            caminho_remoto = f"{remote_dir.rstrip('/')}/{nome}".replace("//", "/")
-            is_dir = entry.longname.startswith("d")
-            data_mod = datetime.fromtimestamp(entry.st_mtime).date()
-
-            if is_dir:
-                arquivos.update(listar_arquivos_sftp_recursivo(sftp, caminho_remoto, filtro_data=filtro_data))
-            else:
-                if filtro_data is None or data_mod == filtro_data:
-                    arquivos[caminho_remoto] = {"tamanho": entry.st_size, "data": data_mod}
-    except Exception as e:
-        logging.error("Erro ao listar %s: %s", remote_dir, e)
-    return arquivos
-
-
-def ensure_remote_dirs(sftp: pysftp.Connection, remote_dir: str) -> None:
-    """Garante que o diretório remoto exista (criando partes intermediárias)."""
-    remote_dir = remote_dir.replace("//", "/")
-    if sftp.exists(remote_dir):
-        return
-
-    parts = remote_dir.strip("/").split("/")
-    path = ""
-    for part in parts:
-        path += "/" + part
-        if not sftp.exists(path):
-            sftp.mkdir(path)
+    paralelismo: int
+    fast_crypto: bool
+    remote_find: bool
+    verificar_hash: bool
+    scp_upload: bool
+    verbose: bool
+    listar_destino: bool
 
 
 def load_job_config() -> cliente1JobConfig:
@@ -209,7 +102,6 @@ def load_job_config() -> cliente1JobConfig:
     dt_exec = datetime.now().strftime("%Y%m%d_%H%M")
     log_filename = f"log_execucao_cliente1_{dt_exec}.log"
 
-    temp_dir = base_dir / "CARGAS" / "cliente1"
     log_path = (base_dir / "logs" / "cliente1" / log_filename)
 
     origem = SFTPConfig(
@@ -235,6 +127,16 @@ def load_job_config() -> cliente1JobConfig:
     disable_hostkey_check = getenv_bool("SFTP_DISABLE_HOSTKEY_CHECK", default=False)
     known_hosts_path = os.getenv("SFTP_KNOWN_HOSTS", "").strip() or None
 
+    paralelismo = getenv_int("SFTP_PARALLELISM", 4)
+    if paralelismo < 1:
+        raise RuntimeError(f"Variável inválida (esperado inteiro >= 1): SFTP_PARALLELISM={paralelismo}")
+    fast_crypto = getenv_bool("SFTP_FAST_CRYPTO", default=False)
+    remote_find = getenv_bool("SFTP_REMOTE_FIND", default=False)
+    verificar_hash = getenv_bool("SFTP_VERIFY_HASH", default=False)
+    scp_upload = getenv_bool("SFTP_SCP_UPLOAD", default=False)
+    verbose = getenv_bool("SFTP_VERBOSE", default=False)
+    listar_destino = getenv_bool("SFTP_DEST_LISTING", default=True)
+
     return cliente1JobConfig(
         origem=origem,
         destino=destino,
@@ -242,129 +144,178 @@ def load_job_config() -> cliente1JobConfig:
         destino_processados_dir=destino_processados_dir,
         destino_log_dir=destino_log_dir,
         base_dir=base_dir,
-        temp_dir=temp_dir,
         log_path=log_path,
         log_filename=log_filename,
         disable_hostkey_check=disable_hostkey_check,
         known_hosts_path=known_hosts_path,
+        paralelismo=paralelismo,
+        fast_crypto=fast_crypto,
+        remote_find=remote_find,
+        verificar_hash=verificar_hash,
+        scp_upload=scp_upload,
+        verbose=verbose,
+        listar_destino=listar_destino,
     )
 
 
 def main() -> None:
     cfg = load_job_config()
-    configurar_logs(cfg.log_path)
+    logs = configurar_logs(cfg.log_path, cfg.verbose, console=True)
 
     status = StatusContador()
     cnopts = build_cnopts(cfg.disable_hostkey_check, cfg.known_hosts_path)
+    if cfg.fast_crypto:
+        aplicar_criptografia_rapida()
     data_hoje = datetime.today().date()
+    # Janela de hoje em epoch, calculada uma vez: a listagem compara inteiros em vez de converter cada mtime em data.
+    hoje_mtime = (
+        int(datetime.combine(data_hoje, time.min).timestamp()),
+        int(datetime.combine(data_hoje + timedelta(days=1), time.min).timestamp()),
+    )
 
-    # 1) Lista destino (uploads + processados)
-    logging.info("Conectando ao SFTP de destino para listar arquivos (uploads + processados)...")
-    with pysftp.Connection(
-        cfg.destino.host,
-        username=cfg.destino.username,
-        password=cfg.destino.password,
-        port=cfg.destino.port,
-        cnopts=cnopts,
-    ) as sftp_dest:
-        arquivos_dest_uploads = listar_arquivos_sftp_recursivo(sftp_dest, cfg.destino_uploads_dir, filtro_data=data_hoje)
-        arquivos_dest_proc = listar_arquivos_sftp_recursivo(sftp_dest, cfg.destino_processados_dir, filtro_data=data_hoje)
-
-        arquivos_dest_rel: Dict[str, Dict[str, Any]] = {}
-        for caminho, dados in {**arquivos_dest_uploads, **arquivos_dest_proc}.items():
-            if "/uploads/" in caminho:
-                rel = caminho.split("/uploads/", 1)[1]
+    # Pools de conexões persistentes: cada thread de transferência usa uma conexão de origem e uma de destino;
+    # a origem tem uma conexão a mais para a listagem, que continua enquanto as transferências acontecem.
+    with PoolSFTP(cfg.origem, cnopts, cfg.paralelismo + 1) as pool_orig, PoolSFTP(cfg.destino, cnopts, cfg.paralelismo) as pool_dest:
+        diretorios_dest: Set[str] = set()
+        try:
+            # 1) Lista destino (uploads + processados)
+            buscar_destino: Callable[[str], Dict[str, Any] | None]
+            if cfg.listar_destino:
+                logging.info("Conectando ao SFTP de destino para listar arquivos (uploads + processados)...")
+                # Um único dict indexado pelo caminho relativo. processados é listado primeiro para que,
+                # se o arquivo estiver nas duas pastas, prevaleça a versão em uploads (a que pode ser substituída).
+                arquivos_dest_rel: Dict[str, Dict[str, Any]] = {}
+                for pasta in (cfg.destino_processados_dir, cfg.destino_uploads_dir):
+                    listar_arquivos_sftp_recursivo(
+                        pool_dest,
+                        pasta,
+                        filtro_mtime=hoje_mtime,
+                        diretorios=diretorios_dest,
+                        usar_find=cfg.remote_find,
+                        remover_prefixo=pasta.rstrip("/") + "/",
+                        arquivos=arquivos_dest_rel,
+                        # Arquivo ausente da listagem seria reenviado (inclusive os já processados).
+                        tolerar_erros=False,
+                    )
+                buscar_destino = arquivos_dest_rel.get
             else:
-                rel = caminho.replace(cfg.destino_uploads_dir.rstrip("/") + "/", "")
-                rel = rel.replace(cfg.destino_processados_dir.rstrip("/") + "/", "")
-            rel = rel.replace("\\", "/").lstrip("/")
-            arquivos_dest_rel[rel] = dados
-
-    # 2) Lista origem (apenas arquivos de hoje)
-    logging.info("Conectando ao SFTP de origem para buscar arquivos do dia...")
-    with pysftp.Connection(
-        cfg.origem.host,
-        username=cfg.origem.username,
-        password=cfg.origem.password,
-        port=cfg.origem.port,
-        cnopts=cnopts,
-    ) as sftp_orig:
-        arquivos_origem = listar_arquivos_sftp_recursivo(sftp_orig, cfg.origem.remote_dir, filtro_data=data_hoje)
-
-        for caminho_remoto, dados in arquivos_origem.items():
-            rel_path = os.path.relpath(caminho_remoto, cfg.origem.remote_dir).replace("\\", "/")
-            destino_path = f"{cfg.destino_uploads_dir.rstrip('/')}/{rel_path}".replace("//", "/")
-
-            # Decide ação
-            if rel_path in arquivos_dest_rel:
-                tam_dest = arquivos_dest_rel[rel_path]["tamanho"]
-                if tam_dest == dados["tamanho"]:
-                    logging.info("Igual (em uploads ou processados): %s – pulando.", rel_path)
-                    status.iguais += 1
-                    continue
-                else:
-                    logging.info("Tamanho diferente: %s – removendo destino (se existir em uploads) e reenviando.", rel_path)
+                logging.info("Listagem do destino desativada (SFTP_DEST_LISTING): consultando cada arquivo com stat.")
+
+                @lru_cache(maxsize=TAMANHO_CACHE_DESTINO)
+                def stat_destino(caminho: str) -> Dict[str, Any] | None:
+                    dados_dest = consultar_destino(pool_dest, caminho)
+                    # Mesmo filtro da listagem: só conta o que foi enviado hoje.
+                    if dados_dest is None or not hoje_mtime[0] <= dados_dest["mtime"] < hoje_mtime[1]:
+                        return None
+                    dados_dest["caminho"] = caminho
+                    return dados_dest
+
+                def buscar_destino(rel: str) -> Dict[str, Any] | None:
+                    # Mesma precedência da listagem: uploads antes de processados.
+                    for pasta in (cfg.destino_uploads_dir, cfg.destino_processados_dir):
+                        dados_dest = stat_destino(f"{pasta.rstrip('/')}/{rel}".replace("//", "/"))
+                        if dados_dest is not None:
+                            return dados_dest
+                    return None
+
+            def divergente_por_hash(origem: str, destino: str) -> bool:
+                """Tamanhos iguais: confirma pelos hashes calculados nos servidores (SFTP_VERIFY_HASH)."""
+                with pool_orig.conexao() as orig, pool_dest.conexao() as dest:
+                    return conteudo_divergente(orig.sftp, origem, dest.sftp, destino)
+
+            prefixo_origem = cfg.origem.remote_dir.rstrip("/") + "/"
+
+            def processar(caminho_remoto: str, dados: Dict[str, Any]) -> None:
+                rel_path = caminho_remoto.removeprefix(prefixo_origem)
+                destino_path = f"{cfg.destino_uploads_dir.rstrip('/')}/{rel_path}".replace("//", "/")
+
+                # Decide ação
+                try:
+                    # Com SFTP_DEST_LISTING=off é um stat no destino, que pode falhar como qualquer envio.
+                    dados_dest = buscar_destino(rel_path)
+                except Exception as e:
+                    logging.error("Erro ao consultar %s no destino: %s", rel_path, e)
+                    status.incrementar("erros_upload")
+                    return
+                if dados_dest is not None:
+                    if dados_dest["tamanho"] != dados["tamanho"]:
+                        motivo = "Tamanho diferente"
+                    elif cfg.verificar_hash and divergente_por_hash(caminho_remoto, dados_dest["caminho"]):
+                        motivo = "Conteúdo diferente (SHA-256)"
+                    else:
+                        logging.debug("Igual (em uploads ou processados): %s – pulando.", rel_path)
+                        status.incrementar("iguais")
+                        return
+
+                    logging.debug("%s: %s – removendo destino (se existir em uploads) e reenviando.", motivo, rel_path)
                     try:
-                        with pysftp.Connection(
-                            cfg.destino.host,
-                            username=cfg.destino.username,
-                            password=cfg.destino.password,
-                            port=cfg.destino.port,
-                            cnopts=cnopts,
-                        ) as sftp_rm:
-                            if sftp_rm.exists(destino_path):
-                                sftp_rm.remove(destino_path)
+                        # A listagem (ou o stat) já diz onde o arquivo está: só há o que remover se estiver em uploads.
+                        if dados_dest["caminho"] == destino_path:
+                            with pool_dest.conexao() as dest:
+                                dest.executar(lambda s: s.remove(destino_path))
                     except Exception as e:
                         logging.error("Erro ao remover %s: %s", destino_path, e)
-                        status.erros_remocao += 1
-                    status.reenviados += 1
-            else:
-                status.novos += 1
-
-            # 3) Download local temporário
-            try:
-                local_temp = cfg.temp_dir / rel_path
-                local_temp.parent.mkdir(parents=True, exist_ok=True)
-                sftp_orig.get(caminho_remoto, str(local_temp))
-            except Exception as e:
-                logging.error("Erro ao baixar %s: %s", caminho_remoto, e)
-                status.erros_download += 1
-                continue
+                        status.incrementar("erros_remocao")
+                    status.incrementar("reenviados")
+                else:
+                    status.incrementar("novos")
 
-            # 4) Upload para destino
-            try:
-                with pysftp.Connection(
-                    cfg.destino.host,
-                    username=cfg.destino.username,
-                    password=cfg.destino.password,
-                    port=cfg.destino.port,
-                    cnopts=cnopts,
-                ) as sftp_envio:
+                # 3-4) Origem -> destino em streaming
+                try:
                     pasta_dest = os.path.dirname(destino_path)
-                    ensure_remote_dirs(sftp_envio, pasta_dest)
-                    sftp_envio.put(str(local_temp), destino_path)
-                    logging.info("Enviado: %s", destino_path)
+                    with pool_orig.conexao() as orig, pool_dest.conexao() as dest:
+                        dest.executar(lambda s: ensure_remote_dirs(s, pasta_dest, diretorios_dest))
+                        transferir_arquivo(
+                            orig.sftp,
+                            dest.sftp,
+                            caminho_remoto,
+                            destino_path,
+                            dados["tamanho"],
+                            verificar_hash=cfg.verificar_hash,
+                            limites_orig=orig.limites,
+                            limites_dest=dest.limites,
+                            scp=dest.sessao_scp(cfg.destino_uploads_dir) if cfg.scp_upload else None,
+                        )
+                    logging.debug("Enviado: %s", destino_path)
+                except ErroLeituraOrigem as e:
+                    logging.error("Erro ao baixar %s: %s", caminho_remoto, e)
+                    status.incrementar("erros_download")
+                except Exception as e:
+                    logging.error("Erro ao enviar %s: %s", rel_path, e)
+                    status.incrementar("erros_upload")
+
+            # 2-4) Lista origem (apenas arquivos de hoje) e transfere em paralelo: cada arquivo entra na fila
+            # assim que seu diretório é listado, sem esperar o fim da listagem.
+            logging.info("Conectando ao SFTP de origem para buscar arquivos do dia...")
+            with ThreadPoolExecutor(max_workers=cfg.paralelismo) as executor:
+                arquivos_origem = percorrer_arquivos_sftp(
+                    pool_orig, cfg.origem.remote_dir, filtro_mtime=hoje_mtime, usar_find=cfg.remote_find
+                )
+                futuros = {executor.submit(processar, caminho, dados): caminho for caminho, dados in arquivos_origem}
+                for processados, futuro in enumerate(as_completed(futuros), 1):
+                    try:
+                        futuro.result()
+                    except Exception as e:
+                        logging.error("Erro inesperado ao processar %s: %s", futuros[futuro], e)
+                    if processados % INTERVALO_PROGRESSO == 0:
+                        status.log_progresso(processados, len(futuros))
+        except Exception as e:
+            # Sem listagem confiável não há o que transferir; o resumo e o log ainda são gerados e enviados.
+            logging.error("Execução interrompida: %s", e)
+            raise
+        finally:
+            status.log_resumo()
+
+            # 5) Upload do log para destino
+            logs.queue.join()  # todos os registros já gravados no arquivo
+            try:
+                log_remoto = f"{cfg.destino_log_dir.rstrip('/')}/{cfg.log_filename}"
+                with pool_dest.conexao() as dest:
+                    dest.executar(lambda s: ensure_remote_dirs(s, cfg.destino_log_dir, diretorios_dest))
+                    dest.executar(lambda s: s.put(str(cfg.log_path), log_remoto))
+                logging.info("Log enviado para o SFTP de destino em: %s", cfg.destino_log_dir)
             except Exception as e:
-                logging.error("Erro ao enviar %s: %s", rel_path, e)
-                status.erros_upload += 1
-
-    status.log_resumo()
-
-    # 5) Upload do log para destino
-    try:
-        with pysftp.Connection(
-            cfg.destino.host,
-            username=cfg.destino.username,
-            password=cfg.destino.password,
-            port=cfg.destino.port,
-            cnopts=cnopts,
-        ) as sftp_log:
-            ensure_remote_dirs(sftp_log, cfg.destino_log_dir)
-            sftp_log.chdir(cfg.destino_log_dir)
-            sftp_log.put(str(cfg.log_path), cfg.log_filename)
-            logging.info("Log enviado para o SFTP de destino em: %s", cfg.destino_log_dir)
-    except Exception as e:
-        logging.error("Erro ao enviar log: %s", e)
+                logging.error("Erro ao enviar log: %s", e)
 
 
 if __name__ == "__main__":
@@ -8,17 +8,18 @@ O que este script faz
 
 2) Conecta no SFTP de destino (Preambulo) e lista arquivos recentes em PREAMBULO_REMOTE_DIR.
 
-3) Conecta no SFTP de origem (cliente2) e lista arquivos recentes em CLIENTE2_REMOTE_DIR.
+3) Conecta no SFTP de origem (cliente2) e lista arquivos recentes em CLIENTE2_REMOTE_DIR;
+   cada arquivo já segue para as etapas 4-5 enquanto a listagem continua.
 
 4) Para cada arquivo recente na origem:
    - Se já existir no destino e o tamanho for igual: pula.
    - Se existir com tamanho diferente: remove e reenviará.
    - Se não existir: envia como novo.
 
-5) Download origem -> pasta temporária local (CARGAS/cliente2/...).
-   Opcionalmente, mantém uma cópia adicional local (KEEP_EXTRA_LOCAL_COPY=true/false) por compatibilidade.
+5) Origem -> destino em streaming (sem arquivo temporário local), criando diretórios remotos.
+   Opcionalmente, grava uma cópia local durante a leitura (KEEP_EXTRA_LOCAL_COPY=true/false) por compatibilidade.
 
-6) Upload para o destino, criando diretórios remotos.
+6) Os arquivos são processados em paralelo (SFTP_PARALLELISM), reutilizando conexões persistentes.
 
 7) Envia o log para PREAMBULO_REMOTE_LOG_DIR.
 
@@ -36,50 +37,34 @@ from __future__ import annotations
 import logging
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
-
-import pysftp
-
-
-def load_env_file(env_path: Path) -> None:
-    """Carrega um arquivo .env simples (KEY=VALUE) para os.environ (sem sobrescrever valores já setados)."""
-    if not env_path.exists():
-        return
-    for raw in env_path.read_text(encoding="utf-8").splitlines():
-        line = raw.strip()
-        if not line or line.startswith("#") or "=" not in line:
-            continue
-        k, v = line.split("=", 1)
-        k = k.strip()
-        v = v.strip().strip('"').strip("'")
-        os.environ.setdefault(k, v)
-
-
-def getenv_required(name: str) -> str:
-    v = os.getenv(name, "").strip()
-    if not v:
-        raise RuntimeError(f"Variável obrigatória ausente: {name}")
-    return v
-
-
-def getenv_int(name: str, default: int) -> int:
-    raw = os.getenv(name, "").strip()
-    if not raw:
-        return default
-    try:
-        return int(raw)
-    except ValueError:
-        raise RuntimeError(f"Variável inválida (esperado inteiro): {name}={raw!r}")
-
-
-def getenv_bool(name: str, default: bool = False) -> bool:
-    raw = os.getenv(name, "").strip().lower()
-    if not raw:
-        return default
-    return raw in ("1", "true", "yes", "y", "on")
+from typing import Any, Callable, Dict, Set
+
+from sftp_comum import (
+    INTERVALO_PROGRESSO,
+    TAMANHO_CACHE_DESTINO,
+    ErroLeituraOrigem,
+    PoolSFTP,
+    SFTPConfig,
+    StatusContador,
+    aplicar_criptografia_rapida,
+    build_cnopts,
+    configurar_logs,
+    consultar_destino,
+    conteudo_divergente,
+    ensure_remote_dirs,
+    getenv_bool,
+    getenv_int,
+    getenv_required,
+    listar_arquivos_sftp_recursivo,
+    load_env_file,
+    percorrer_arquivos_sftp,
+    transferir_arquivo,
+)
 
 
 def get_base_dir() -> Path:
@@ -93,15 +78,6 @@ def get_base_dir() -> Path:
     return Path(__file__).resolve().parent
 
 
-@dataclass(frozen=True)
-class SFTPConfig:
-    host: str
-    port: int
-    username: str
-    password: str
-    remote_dir: str
-
-
 @dataclass(frozen=True)
 class Cliente2JobConfig:
     origem: SFTPConfig
@@ -111,116 +87,21 @@ class Cliente2JobConfig:
     days_back: int
 
     base_dir: Path
-    temp_dir: Path
     log_path: Path
     log_filename: str
 
     disable_hostkey_check: bool
     known_hosts_path: str | None
 
-    keep_extra_local_copy: bool
-
-
-class StatusContador:
-    def __init__(self) -> None:
-        self.novos = 0
-        self.iguais = 0
-        self.reenviados = 0
-        self.erros_download = 0
-        self.erros_upload = 0
-        self.erros_remocao = 0
-
-    def log_resumo(self) -> None:
-        logging.info("--- Resumo Final ---")
-        logging.info("Arquivos novos enviados: %s", self.novos)
-        logging.info("Arquivos iguais pulados: %s", self.iguais)
-        logging.info("Arquivos reenviados (substituídos): %s", self.reenviados)
-        logging.info("Erros ao baixar: %s", self.erros_download)
-        logging.info("Erros ao enviar: %s", self.erros_upload)
-        logging.info("Erros ao remover: %s", self.erros_remocao)
-
-
-def build_cnopts(disable_hostkey_check: bool, known_hosts_path: str | None) -> pysftp.CnOpts:
-    cnopts = pysftp.CnOpts()
-    if disable_hostkey_check:
-        cnopts.hostkeys = None
-        return cnopts
-
-    if known_hosts_path:
-        p = Path(known_hosts_path)
-        if not p.exists():
-            raise RuntimeError(f"SFTP_KNOWN_HOSTS não encontrado: {known_hosts_path}")
-        cnopts.hostkeys.load(str(p))
-    return cnopts
-
-
-def configurar_logs(log_path: Path) -> None:
-    log_path.parent.mkdir(parents=True, exist_ok=True)
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler(str(log_path), encoding="utf-8"),
-            # logging.StreamHandler(),  # habilite se quiser ver no console
-        ],
-    )
-    logging.getLogger("paramiko").setLevel(logging.WARNING)
-
-
-def listar_arquivos_sftp_recursivo(
-    sftp: pysftp.Connection,
-    remote_dir: str,
-    *,
-    nivel: int = 0,
-    filtro_data_min: datetime.date | None = None,
-) -> Dict[str, Dict[str, Any]]:
-    """
-    Lista arquivos recursivamente.
-
-    - Se `filtro_data_min` for informado:
-      * inclui arquivos com data_modificacao >= filtro_data_min
-      * pode pular pastas antigas no nível 0 (heurística simples)
-    """
-    arquivos: Dict[str, Dict[str, Any]] = {}
-    try:
-        entries = sftp.listdir_attr(remote_dir)
-        for entry in entries:
-            nome = entry.filename
-            caminho_remoto = f"{remote_dir.rstrip('/')}/{nome}".replace("//", "/")
-            is_dir = entry.longname.startswith("d")
-            data_mod = datetime.fromtimestamp(entry.st_mtime).date()
-
-            if is_dir:
-                if nivel == 0 and filtro_data_min and data_mod < filtro_data_min:
-                    logging.info("Pulando pasta antiga (nível 0): %s", caminho_remoto)
-                    continue
-                arquivos.update(
-                    listar_arquivos_sftp_recursivo(
-                        sftp,
-                        caminho_remoto,
-                        nivel=nivel + 1,
-                        filtro_data_min=filtro_data_min,
-                    )
-                )
-            else:
-                if not filtro_data_min or data_mod >= filtro_data_min:
-                    arquivos[caminho_remoto] = {"tamanho": entry.st_size, "data": data_mod}
-    except Exception as e:
-        logging.error("Erro ao listar %s: %s", remote_dir, e)
-
-    return arquivos
-
+    paralelismo: int
+    fast_crypto: bool
+    remote_find: bool
+    verificar_hash: bool
+    scp_upload: bool
+    verbose: bool
+    listar_destino: bool
 
-def ensure_remote_dirs(sftp: pysftp.Connection, remote_dir: str) -> None:
-    remote_dir = remote_dir.replace("//", "/")
-    if sftp.exists(remote_dir):
-        return
-    parts = remote_dir.strip("/").split("/")
-    path = ""
-    for part in parts:
-        path += "/" + part
-        if not sftp.exists(path):
-            sftp.mkdir(path)
+    keep_extra_local_copy: bool
 
 
 def load_job_config() -> Cliente2JobConfig:
@@ -230,7 +111,6 @@ def load_job_config() -> Cliente2JobConfig:
     dt_exec = datetime.now().strftime("%Y%m%d_%H%M")
     log_filename = f"log_execucao_cliente2_{dt_exec}.log"
 
-    temp_dir = base_dir / "CARGAS" / "cliente2"
     log_path = (base_dir / "logs" / "cliente2" / log_filename)
 
     days_back = getenv_int("DAYS_BACK", 2)
@@ -256,6 +136,16 @@ def load_job_config() -> Cliente2JobConfig:
     disable_hostkey_check = getenv_bool("SFTP_DISABLE_HOSTKEY_CHECK", default=False)
     known_hosts_path = os.getenv("SFTP_KNOWN_HOSTS", "").strip() or None
 
+    paralelismo = getenv_int("SFTP_PARALLELISM", 4)
+    if paralelismo < 1:
+        raise RuntimeError(f"Variável inválida (esperado inteiro >= 1): SFTP_PARALLELISM={paralelismo}")
+    fast_crypto = getenv_bool("SFTP_FAST_CRYPTO", default=False)
+    remote_find = getenv_bool("SFTP_REMOTE_FIND", default=False)
+    verificar_hash = getenv_bool("SFTP_VERIFY_HASH", default=False)
+    scp_upload = getenv_bool("SFTP_SCP_UPLOAD", default=False)
+    verbose = getenv_bool("SFTP_VERBOSE", default=False)
+    listar_destino = getenv_bool("SFTP_DEST_LISTING", default=True)
+
     keep_extra_local_copy = getenv_bool("KEEP_EXTRA_LOCAL_COPY", default=True)
 
     return Cliente2JobConfig(
@@ -264,126 +154,175 @@ def load_job_config() -> Cliente2JobConfig:
         destino_log_dir=destino_log_dir,
         days_back=days_back,
         base_dir=base_dir,
-        temp_dir=temp_dir,
         log_path=log_path,
         log_filename=log_filename,
         disable_hostkey_check=disable_hostkey_check,
         known_hosts_path=known_hosts_path,
+        paralelismo=paralelismo,
+        fast_crypto=fast_crypto,
+        remote_find=remote_find,
+        verificar_hash=verificar_hash,
+        scp_upload=scp_upload,
+        verbose=verbose,
+        listar_destino=listar_destino,
         keep_extra_local_copy=keep_extra_local_copy,
     )
 
 
 def main() -> None:
     cfg = load_job_config()
-    configurar_logs(cfg.log_path)
+    logs = configurar_logs(cfg.log_path, cfg.verbose)
 
     status = StatusContador()
     cnopts = build_cnopts(cfg.disable_hostkey_check, cfg.known_hosts_path)
+    if cfg.fast_crypto:
+        aplicar_criptografia_rapida()
     data_limite = (datetime.today() - timedelta(days=cfg.days_back)).date()
-
-    logging.info("Conectando ao SFTP de destino para listar arquivos recentes...")
-    with pysftp.Connection(
-        cfg.destino.host,
-        username=cfg.destino.username,
-        password=cfg.destino.password,
-        port=cfg.destino.port,
-        cnopts=cnopts,
-    ) as sftp_pre:
-        arquivos_destino = listar_arquivos_sftp_recursivo(sftp_pre, cfg.destino.remote_dir, filtro_data_min=data_limite)
-
-    logging.info("Arquivos recentes no destino: %s", len(arquivos_destino))
-
-    logging.info("Conectando ao SFTP de origem para verificar arquivos recentes...")
-    with pysftp.Connection(
-        cfg.origem.host,
-        username=cfg.origem.username,
-        password=cfg.origem.password,
-        port=cfg.origem.port,
-        cnopts=cnopts,
-    ) as sftp_rec:
-        arquivos_origem = listar_arquivos_sftp_recursivo(sftp_rec, cfg.origem.remote_dir, filtro_data_min=data_limite)
-        logging.info("Arquivos recentes na origem: %s", len(arquivos_origem))
-
-        for caminho, dados in arquivos_origem.items():
-            rel_path = os.path.relpath(caminho, cfg.origem.remote_dir).replace("\\", "/")
-            caminho_dest = f"{cfg.destino.remote_dir.rstrip('/')}/{rel_path}".replace("//", "/")
-
-            if caminho_dest in arquivos_destino:
-                tam_pre = arquivos_destino[caminho_dest]["tamanho"]
-                if tam_pre == dados["tamanho"]:
-                    logging.info("Igual: %s – pulando.", rel_path)
-                    status.iguais += 1
-                    continue
-                else:
-                    logging.info("Tamanho diferente: %s – removendo e reenviando.", rel_path)
+    # Início da janela em epoch, calculado uma vez: a listagem compara inteiros em vez de converter cada mtime em data.
+    mtime_limite = int(datetime.combine(data_limite, time.min).timestamp())
+
+    # Pools de conexões persistentes: cada thread de transferência usa uma conexão de origem e uma de destino;
+    # a origem tem uma conexão a mais para a listagem, que continua enquanto as transferências acontecem.
+    with PoolSFTP(cfg.origem, cnopts, cfg.paralelismo + 1) as pool_orig, PoolSFTP(cfg.destino, cnopts, cfg.paralelismo) as pool_dest:
+        diretorios_dest: Set[str] = set()
+        try:
+            buscar_destino: Callable[[str], Dict[str, Any] | None]
+            if cfg.listar_destino:
+                logging.info("Conectando ao SFTP de destino para listar arquivos recentes...")
+                arquivos_destino = listar_arquivos_sftp_recursivo(
+                    pool_dest,
+                    cfg.destino.remote_dir,
+                    filtro_mtime=(mtime_limite, None),
+                    pular_pastas_antigas=True,
+                    diretorios=diretorios_dest,
+                    usar_find=cfg.remote_find,
+                    # Arquivo ausente da listagem seria tratado como novo.
+                    tolerar_erros=False,
+                )
+                logging.info("Arquivos recentes no destino: %s", len(arquivos_destino))
+                buscar_destino = arquivos_destino.get
+            else:
+                logging.info("Listagem do destino desativada (SFTP_DEST_LISTING): consultando cada arquivo com stat.")
+
+                @lru_cache(maxsize=TAMANHO_CACHE_DESTINO)
+                def buscar_destino(caminho_dest: str) -> Dict[str, Any] | None:
+                    dados_dest = consultar_destino(pool_dest, caminho_dest)
+                    # Mesmo filtro da listagem: só conta o que é recente.
+                    if dados_dest is None or dados_dest["mtime"] < mtime_limite:
+                        return None
+                    return dados_dest
+
+            def divergente_por_hash(origem: str, destino: str) -> bool:
+                """Tamanhos iguais: confirma pelos hashes calculados nos servidores (SFTP_VERIFY_HASH)."""
+                with pool_orig.conexao() as orig, pool_dest.conexao() as dest:
+                    return conteudo_divergente(orig.sftp, origem, dest.sftp, destino)
+
+            # Os caminhos da listagem são montados a partir de remote_dir: basta remover o prefixo.
+            prefixo_origem = cfg.origem.remote_dir.rstrip("/") + "/"
+
+            def processar(caminho: str, dados: Dict[str, Any]) -> None:
+                rel_path = caminho.removeprefix(prefixo_origem)
+                caminho_dest = f"{cfg.destino.remote_dir.rstrip('/')}/{rel_path}".replace("//", "/")
+
+                try:
+                    # Com SFTP_DEST_LISTING=off é um stat no destino, que pode falhar como qualquer envio.
+                    dados_dest = buscar_destino(caminho_dest)
+                except Exception as e:
+                    logging.error("Erro ao consultar %s no destino: %s", rel_path, e)
+                    status.incrementar("erros_upload")
+                    return
+                if dados_dest is not None:
+                    tam_pre = dados_dest["tamanho"]
+                    if tam_pre != dados["tamanho"]:
+                        motivo = "Tamanho diferente"
+                    elif cfg.verificar_hash and divergente_por_hash(caminho, caminho_dest):
+                        motivo = "Conteúdo diferente (SHA-256)"
+                    else:
+                        logging.debug("Igual: %s – pulando.", rel_path)
+                        status.incrementar("iguais")
+                        return
+
+                    logging.debug("%s: %s – removendo e reenviando.", motivo, rel_path)
                     try:
-                        with pysftp.Connection(
-                            cfg.destino.host,
-                            username=cfg.destino.username,
-                            password=cfg.destino.password,
-                            port=cfg.destino.port,
-                            cnopts=cnopts,
-                        ) as sftp_rm:
-                            if sftp_rm.exists(caminho_dest):
-                                sftp_rm.remove(caminho_dest)
-                                logging.info("Arquivo antigo removido: %s", caminho_dest)
+                        # Existência já confirmada pela listagem do destino (ou pelo stat).
+                        with pool_dest.conexao() as dest:
+                            dest.executar(lambda s: s.remove(caminho_dest))
+                        logging.debug("Arquivo antigo removido: %s", caminho_dest)
                     except Exception as e:
                         logging.error("Erro ao remover %s: %s", caminho_dest, e)
-                        status.erros_remocao += 1
-                    status.reenviados += 1
-            else:
-                logging.info("Novo arquivo: %s – enviando.", rel_path)
-                status.novos += 1
+                        status.incrementar("erros_remocao")
+                    status.incrementar("reenviados")
+                else:
+                    logging.debug("Novo arquivo: %s – enviando.", rel_path)
+                    status.incrementar("novos")
 
-            # Download
-            try:
-                local_temp = cfg.temp_dir / rel_path
-                local_temp.parent.mkdir(parents=True, exist_ok=True)
-                sftp_rec.get(caminho, str(local_temp))
-
-                if cfg.keep_extra_local_copy:
-                    local_copy = cfg.base_dir / rel_path
-                    local_copy.parent.mkdir(parents=True, exist_ok=True)
-                    sftp_rec.get(caminho, str(local_copy))
-            except Exception as e:
-                logging.error("Erro ao baixar %s: %s", caminho, e)
-                status.erros_download += 1
-                continue
+                # Download + upload em streaming (com cópia local opcional)
+                try:
+                    local_copy = None
+                    if cfg.keep_extra_local_copy:
+                        local_copy = cfg.base_dir / rel_path
+                        local_copy.parent.mkdir(parents=True, exist_ok=True)
 
-            # Upload
-            try:
-                with pysftp.Connection(
-                    cfg.destino.host,
-                    username=cfg.destino.username,
-                    password=cfg.destino.password,
-                    port=cfg.destino.port,
-                    cnopts=cnopts,
-                ) as sftp_envio:
                     pasta_dest = os.path.dirname(caminho_dest)
-                    ensure_remote_dirs(sftp_envio, pasta_dest)
-                    sftp_envio.put(str(local_temp), caminho_dest)
-                    logging.info("Arquivo enviado: %s", caminho_dest)
+                    with pool_orig.conexao() as orig, pool_dest.conexao() as dest:
+                        dest.executar(lambda s: ensure_remote_dirs(s, pasta_dest, diretorios_dest))
+                        transferir_arquivo(
+                            orig.sftp,
+                            dest.sftp,
+                            caminho,
+                            caminho_dest,
+                            dados["tamanho"],
+                            copia_local=local_copy,
+                            verificar_hash=cfg.verificar_hash,
+                            limites_orig=orig.limites,
+                            limites_dest=dest.limites,
+                            scp=dest.sessao_scp(cfg.destino.remote_dir) if cfg.scp_upload else None,
+                        )
+                    logging.debug("Arquivo enviado: %s", caminho_dest)
+                except ErroLeituraOrigem as e:
+                    logging.error("Erro ao baixar %s: %s", caminho, e)
+                    status.incrementar("erros_download")
+                except Exception as e:
+                    logging.error("Erro ao enviar %s: %s", rel_path, e)
+                    status.incrementar("erros_upload")
+
+            # Lista a origem e transfere em paralelo: cada arquivo entra na fila
+            # assim que seu diretório é listado, sem esperar o fim da listagem.
+            logging.info("Conectando ao SFTP de origem para verificar arquivos recentes...")
+            with ThreadPoolExecutor(max_workers=cfg.paralelismo) as executor:
+                arquivos_origem = percorrer_arquivos_sftp(
+                    pool_orig,
+                    cfg.origem.remote_dir,
+                    filtro_mtime=(mtime_limite, None),
+                    pular_pastas_antigas=True,
+                    usar_find=cfg.remote_find,
+                )
+                futuros = {executor.submit(processar, caminho, dados): caminho for caminho, dados in arquivos_origem}
+                logging.info("Arquivos recentes na origem: %s", len(futuros))
+                for processados, futuro in enumerate(as_completed(futuros), 1):
+                    try:
+                        futuro.result()
+                    except Exception as e:
+                        logging.error("Erro inesperado ao processar %s: %s", futuros[futuro], e)
+                    if processados % INTERVALO_PROGRESSO == 0:
+                        status.log_progresso(processados, len(futuros))
+        except Exception as e:
+            # Sem listagem confiável não há o que transferir; o resumo e o log ainda são gerados e enviados.
+            logging.error("Execução interrompida: %s", e)
+            raise
+        finally:
+            status.log_resumo()
+
+            # Upload do log
+            logs.queue.join()  # todos os registros já gravados no arquivo
+            try:
+                log_remoto = f"{cfg.destino_log_dir.rstrip('/')}/{cfg.log_filename}"
+                with pool_dest.conexao() as dest:
+                    dest.executar(lambda s: ensure_remote_dirs(s, cfg.destino_log_dir, diretorios_dest))
+                    dest.executar(lambda s: s.put(str(cfg.log_path), log_remoto))
+                logging.info("Log enviado para o destino em: %s", cfg.destino_log_dir)
             except Exception as e:
-                logging.error("Erro ao enviar %s: %s", rel_path, e)
-                status.erros_upload += 1
-
-    status.log_resumo()
-
-    # Upload do log
-    try:
-        with pysftp.Connection(
-            cfg.destino.host,
-            username=cfg.destino.username,
-            password=cfg.destino.password,
-            port=cfg.destino.port,
-            cnopts=cnopts,
-        ) as sftp_log:
-            ensure_remote_dirs(sftp_log, cfg.destino_log_dir)
-            sftp_log.chdir(cfg.destino_log_dir)
-            sftp_log.put(str(cfg.log_path), cfg.log_filename)
-            logging.info("Log enviado para o destino em: %s", cfg.destino_log_dir)
-    except Exception as e:
-        logging.error("Erro ao enviar log: %s", e)
+                logging.error("Erro ao enviar log: %s", e)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,891 @@
+# sftp_comum.py
+"""
+sftp_comum.py — Código compartilhado por SFTP_Cliente1.py e SFTP_Cliente2.py
+
+Configuração via variáveis de ambiente/.env, conexões SFTP e o que os dois scripts fazem da mesma forma.
+Cada script mantém só o que é dele: a configuração do job (load_job_config) e o fluxo (main).
+Este arquivo precisa ficar junto dos scripts (o PyInstaller o inclui por ser importado).
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shlex
+import stat
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import IO, Any, Callable, Collection, Dict, Iterator, List, Set, Tuple, TypeVar
+
+import paramiko
+import pysftp
+from paramiko.sftp import CMD_EXTENDED, CMD_EXTENDED_REPLY
+from paramiko.sftp_file import SFTPFile
+
+
+T = TypeVar("T")
+
+# Linhas KEY=VALUE do .env; valores entre aspas são usados literalmente, os demais sem espaços nas pontas.
+_ENV_RE = re.compile(
+    r"""^[ \t]*([A-Za-z_][A-Za-z0-9_]*)[ \t]*=[ \t]*(?:"([^"\r\n]*)"|'([^'\r\n]*)'|([^\r\n]*))""",
+    re.MULTILINE,
+)
+
+# Serializa a criação de diretórios no destino entre as threads de transferência.
+_LOCK_DIRS_REMOTOS = threading.Lock()
+
+# Requisições READ mantidas em voo durante a leitura da origem (prefetch).
+MAX_LEITURAS_PENDENTES = 64
+
+# Bytes em voo por arquivo durante o prefetch; com READs maiores (limits@openssh.com) são necessárias menos requisições.
+JANELA_PREFETCH = 8 * 1024 * 1024
+
+# Teto para o tamanho de cada READ/WRITE, mesmo que o servidor anuncie limites maiores.
+MAX_TAMANHO_REQUISICAO = 256 * 1024
+
+# Limites SFTP por (host, porta, usuário), consultados uma vez por execução.
+_LIMITES_SFTP: Dict[Tuple[str, int, str], LimitesSFTP] = {}
+
+_LOCK_LIMITES_SFTP = threading.Lock()
+
+# Algoritmos priorizados com SFTP_FAST_CRYPTO: AES-GCM/CTR usam AES-NI via OpenSSL,
+# curve25519 é a troca de chaves mais barata e os MACs ETM evitam trabalho extra com cifras CTR.
+CIFRAS_RAPIDAS = ("aes128-gcm@openssh.com", "aes128-ctr")
+
+KEX_RAPIDOS = ("curve25519-sha256", "curve25519-sha256@libssh.org")
+
+MACS_RAPIDOS = ("hmac-sha2-256-etm@openssh.com",)
+
+# Tempo máximo (segundos) sem receber saída do `find` remoto (SFTP_REMOTE_FIND).
+TIMEOUT_FIND_REMOTO = 600
+
+# Servidores (endereço do transporte SSH) sem a extensão check-file: SFTP_VERIFY_HASH deixa de consultá-los.
+_CHECK_FILE_INDISPONIVEL: Set[Tuple[Any, ...]] = set()
+
+# Consultas stat ao destino mantidas em cache quando a listagem do destino está desativada (SFTP_DEST_LISTING=off).
+TAMANHO_CACHE_DESTINO = 100_000
+
+# A cada quantos arquivos processados um resumo parcial é registrado no log.
+INTERVALO_PROGRESSO = 1000
+
+# Tempo máximo (segundos) sem resposta do `scp -t` no destino (SFTP_SCP_UPLOAD).
+TIMEOUT_SCP_REMOTO = 600
+
+# Tempo máximo (segundos) para a primeira resposta do `scp -t`; sem ela, o scp é considerado indisponível.
+TIMEOUT_SCP_INICIO = 10
+
+# Servidores (endereço do transporte SSH) em que `scp -t` não pôde ser executado: envio volta ao SFTP.
+_SCP_INDISPONIVEL: Set[Tuple[Any, ...]] = set()
+
+
+def load_env_file(env_path: Path) -> None:
+    """Carrega um arquivo .env simples (KEY=VALUE) para os.environ (sem sobrescrever valores já setados)."""
+    if not env_path.exists():
+        return
+    for m in _ENV_RE.finditer(env_path.read_text(encoding="utf-8-sig")):
+        k, aspas_duplas, aspas_simples, valor = m.groups()
+        if aspas_duplas is not None:
+            valor = aspas_duplas
+        elif aspas_simples is not None:
+            valor = aspas_simples
+        else:
+            valor = valor.strip()
+        os.environ.setdefault(k, valor)
+
+
+def getenv_required(name: str) -> str:
+    v = os.getenv(name, "").strip()
+    if not v:
+        raise RuntimeError(f"Variável obrigatória ausente: {name}")
+    return v
+
+
+def getenv_int(name: str, default: int) -> int:
+    raw = os.getenv(name, "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        raise RuntimeError(f"Variável inválida (esperado inteiro): {name}={raw!r}")
+
+
+def getenv_bool(name: str, default: bool = False) -> bool:
+    raw = os.getenv(name, "").strip().lower()
+    if not raw:
+        return default
+    return raw in ("1", "true", "yes", "y", "on")
+
+
+@dataclass(frozen=True)
+class SFTPConfig:
+    host: str
+    port: int
+    username: str
+    password: str
+    remote_dir: str
+
+
+class StatusContador:
+    def __init__(self) -> None:
+        self.novos = 0
+        self.iguais = 0
+        self.reenviados = 0
+        self.erros_download = 0
+        self.erros_upload = 0
+        self.erros_remocao = 0
+        self._lock = threading.Lock()
+
+    def incrementar(self, campo: str) -> None:
+        """Incrementa um contador; seguro para uso a partir das threads de transferência."""
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def log_progresso(self, processados: int, total: int) -> None:
+        logging.info(
+            "Processados %s de %s arquivos (novos=%s, iguais=%s, reenviados=%s, erros=%s)",
+            processados,
+            total,
+            self.novos,
+            self.iguais,
+            self.reenviados,
+            self.erros_download + self.erros_upload + self.erros_remocao,
+        )
+
+    def log_resumo(self) -> None:
+        logging.info("--- Resumo Final ---")
+        logging.info("Arquivos novos enviados: %s", self.novos)
+        logging.info("Arquivos iguais pulados: %s", self.iguais)
+        logging.info("Arquivos reenviados (substituídos): %s", self.reenviados)
+        logging.info("Erros ao baixar: %s", self.erros_download)
+        logging.info("Erros ao enviar: %s", self.erros_upload)
+        logging.info("Erros ao remover: %s", self.erros_remocao)
+
+
+def configurar_logs(log_path: Path, verbose: bool = False, console: bool = False) -> logging.handlers.QueueListener:
+    """
+    A escrita do log (arquivo e, com `console`, o terminal) acontece numa thread de fundo (QueueListener):
+    as threads de transferência só montam a mensagem e enfileiram o registro, sem esperar pelo disco.
+
+    As mensagens por arquivo são DEBUG e só são registradas com `verbose` (SFTP_VERBOSE); sem ele,
+    o andamento aparece a cada INTERVALO_PROGRESSO arquivos.
+
+    Antes de ler o arquivo de log (ex.: para enviá-lo), aguarde a fila esvaziar com `listener.queue.join()`.
+    """
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    formato = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
+    handlers: List[logging.Handler] = [logging.FileHandler(str(log_path), encoding="utf-8")]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formato)
+
+    log_queue: queue.Queue[logging.LogRecord] = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # O QueueHandler só interpola a mensagem (prepare); data e nível são formatados pelos handlers da thread de fundo.
+    handler_fila = logging.handlers.QueueHandler(log_queue)
+    handler_fila.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO, handlers=[handler_fila])
+    logging.getLogger("paramiko").setLevel(logging.WARNING)
+    return listener
+
+
+def build_cnopts(disable_hostkey_check: bool, known_hosts_path: str | None) -> pysftp.CnOpts:
+    cnopts = pysftp.CnOpts()
+    if disable_hostkey_check:
+        cnopts.hostkeys = None
+        return cnopts
+
+    if known_hosts_path:
+        p = Path(known_hosts_path)
+        if not p.exists():
+            raise RuntimeError(f"SFTP_KNOWN_HOSTS não encontrado: {known_hosts_path}")
+        cnopts.hostkeys.load(str(p))
+    return cnopts
+
+
+def _priorizar(preferidos: Tuple[str, ...], atuais: Tuple[str, ...], suportados: Collection[str]) -> Tuple[str, ...]:
+    primeiros = tuple(alg for alg in preferidos if alg in suportados)
+    return primeiros + tuple(alg for alg in atuais if alg not in primeiros)
+
+
+def aplicar_criptografia_rapida() -> None:
+    """
+    Coloca cifras, KEX e MACs rápidos no topo das preferências do paramiko (vale para todo o processo).
+
+    Os demais algoritmos continuam na lista, então servidores sem suporte aos preferidos seguem compatíveis.
+    """
+    t = paramiko.Transport
+    t._preferred_ciphers = _priorizar(CIFRAS_RAPIDAS, t._preferred_ciphers, t._cipher_info)
+    t._preferred_kex = _priorizar(KEX_RAPIDOS, t._preferred_kex, t._kex_info)
+    t._preferred_macs = _priorizar(MACS_RAPIDOS, t._preferred_macs, t._mac_info)
+
+
+def conectar_sftp(cfg: SFTPConfig, cnopts: pysftp.CnOpts) -> pysftp.Connection:
+    return pysftp.Connection(
+        cfg.host,
+        username=cfg.username,
+        password=cfg.password,
+        port=cfg.port,
+        cnopts=cnopts,
+    )
+
+
+@dataclass(frozen=True)
+class LimitesSFTP:
+    """Tamanhos de READ/WRITE usados com um servidor (padrão do paramiko se limits@openssh.com não for suportada)."""
+
+    max_leitura: int = SFTPFile.MAX_REQUEST_SIZE
+    max_escrita: int = SFTPFile.MAX_REQUEST_SIZE
+
+
+def consultar_limites(sftp: pysftp.Connection) -> LimitesSFTP:
+    """
+    Consulta a extensão limits@openssh.com (OpenSSH 8.5+), que anuncia max-packet-length, max-read-length,
+    max-write-length e max-open-handles do servidor. Limite 0 significa "sem limite"; os valores são
+    limitados a MAX_TAMANHO_REQUISICAO.
+    """
+    try:
+        tipo, msg = sftp.sftp_client._request(CMD_EXTENDED, "limits@openssh.com")
+        if tipo != CMD_EXTENDED_REPLY:  # ex.: STATUS OK de servidor fora do padrão, sem limites
+            return LimitesSFTP()
+        msg.get_int64()  # max-packet-length
+        max_leitura = msg.get_int64() or MAX_TAMANHO_REQUISICAO
+        max_escrita = msg.get_int64() or MAX_TAMANHO_REQUISICAO
+    except (IOError, paramiko.SSHException):
+        return LimitesSFTP()
+    return LimitesSFTP(min(max_leitura, MAX_TAMANHO_REQUISICAO), min(max_escrita, MAX_TAMANHO_REQUISICAO))
+
+
+class ErroConexaoSFTP(Exception):
+    """Falha ao abrir a conexão SFTP com um servidor."""
+
+
+class ConexaoSFTP:
+    """
+    Conexão SFTP persistente, aberta sob demanda e reutilizada durante toda a execução.
+
+    Se o canal SSH cair (paramiko.SSHException), a conexão é reaberta e a operação repetida uma vez.
+    """
+
+    def __init__(self, cfg: SFTPConfig, cnopts: pysftp.CnOpts) -> None:
+        self.cfg = cfg
+        self.cnopts = cnopts
+        self._sftp: pysftp.Connection | None = None
+        self._scp: SessaoSCP | None = None
+
+    @property
+    def sftp(self) -> pysftp.Connection:
+        if self._sftp is not None and not self._ativa():
+            logging.warning("Conexão SFTP com %s encerrada – reconectando.", self.cfg.host)
+            self.fechar()
+        if self._sftp is None:
+            try:
+                self._sftp = conectar_sftp(self.cfg, self.cnopts)
+            except Exception as e:
+                raise ErroConexaoSFTP(f"{self.cfg.host}:{self.cfg.port}: {e}") from e
+        return self._sftp
+
+    def _ativa(self) -> bool:
+        """Verifica localmente (sem round trip) se o canal SFTP e o transporte SSH continuam abertos."""
+        try:
+            canal = self._sftp.sftp_client.get_channel()
+            return not canal.closed and canal.get_transport().is_active()
+        except Exception:
+            return False
+
+    @property
+    def limites(self) -> LimitesSFTP:
+        """Limites do servidor, consultados na primeira conexão e compartilhados pelas demais do mesmo pool."""
+        chave = (self.cfg.host, self.cfg.port, self.cfg.username)
+        with _LOCK_LIMITES_SFTP:
+            limites = _LIMITES_SFTP.get(chave)
+        if limites is None:
+            limites = consultar_limites(self.sftp)
+            with _LOCK_LIMITES_SFTP:
+                _LIMITES_SFTP[chave] = limites
+            if limites != LimitesSFTP():
+                logging.info(
+                    "Limites SFTP de %s: READ %d bytes, WRITE %d bytes.",
+                    self.cfg.host, limites.max_leitura, limites.max_escrita,
+                )
+        return limites
+
+    def sessao_scp(self, raiz: str) -> SessaoSCP:
+        """`scp -r -t` desta conexão (ver SessaoSCP), aberto no primeiro envio e reaproveitado pelos seguintes."""
+        if self._scp is None:
+            self._scp = SessaoSCP(raiz)
+        return self._scp
+
+    def executar(self, operacao: Callable[[pysftp.Connection], T]) -> T:
+        try:
+            return operacao(self.sftp)
+        except paramiko.SSHException as e:
+            logging.warning("Conexão SFTP com %s perdida (%s) – reconectando.", self.cfg.host, e)
+            self.fechar()
+            return operacao(self.sftp)
+
+    def fechar(self) -> None:
+        if self._scp is not None:
+            self._scp.fechar()
+        if self._sftp is None:
+            return
+        try:
+            self._sftp.close()
+        except Exception:
+            pass
+        self._sftp = None
+
+    def __enter__(self) -> ConexaoSFTP:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.fechar()
+
+
+class PoolSFTP:
+    """
+    Pool de até `tamanho` conexões persistentes (ConexaoSFTP) com o mesmo servidor.
+
+    As conexões só são abertas no primeiro uso; a fila LIFO devolve primeiro a conexão usada
+    mais recentemente, então execuções com pouco trabalho não abrem conexões desnecessárias.
+    """
+
+    def __init__(self, cfg: SFTPConfig, cnopts: pysftp.CnOpts, tamanho: int) -> None:
+        self.cfg = cfg
+        self.tamanho = max(1, tamanho)
+        self._conexoes = [ConexaoSFTP(cfg, cnopts) for _ in range(self.tamanho)]
+        self._livres: queue.LifoQueue[ConexaoSFTP] = queue.LifoQueue()
+        for conn in self._conexoes:
+            self._livres.put(conn)
+
+    @contextmanager
+    def conexao(self) -> Iterator[ConexaoSFTP]:
+        conn = self._livres.get()
+        try:
+            yield conn
+        finally:
+            self._livres.put(conn)
+
+    def fechar(self) -> None:
+        for conn in self._conexoes:
+            conn.fechar()
+
+    def __enter__(self) -> PoolSFTP:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.fechar()
+
+
+def listar_via_find(sftp: pysftp.Connection, remote_dir: str) -> Dict[str, List[paramiko.SFTPAttributes]] | None:
+    """
+    Lista a árvore inteira de `remote_dir` com um único `find` executado no servidor (canal exec do SSH).
+
+    Retorna { diretorio: [entradas] }, no mesmo formato de listdir_attr, ou None se o servidor não permitir
+    exec (ex.: contas restritas a SFTP) ou a saída não for reconhecida. A saída só é aceita se trouxer o registro
+    do próprio `remote_dir`: contas com ForceCommand internal-sftp aceitam o exec e terminam com código 0 sem saída.
+    Só faz sentido quando o caminho visto pelo SFTP é o mesmo do shell (sem chroot).
+    """
+    comando = (
+        f"find {shlex.quote(remote_dir)}"
+        r" -type d -printf 'd\t%s\t%T@\t%p\0' -o -printf 'f\t%s\t%T@\t%p\0'"
+    )
+    try:
+        canal = sftp.sftp_client.get_channel().get_transport().open_session()
+        try:
+            canal.settimeout(TIMEOUT_FIND_REMOTO)
+            canal.exec_command(comando)
+            canal.shutdown_write()
+            saida = canal.makefile("rb").read()
+            codigo = canal.recv_exit_status()
+        finally:
+            canal.close()
+        if codigo != 0:
+            raise RuntimeError(f"find terminou com código {codigo}")
+
+        indice: Dict[str, List[paramiko.SFTPAttributes]] = {}
+        raiz = remote_dir.rstrip("/")
+        raiz_encontrada = False
+        for registro in saida.split(b"\0"):
+            if not registro:
+                continue
+            tipo, tamanho, mtime, caminho = registro.decode("utf-8").split("\t", 3)
+            if caminho.rstrip("/") == raiz:
+                raiz_encontrada = tipo == "d"
+                continue
+            pai, nome = caminho.rstrip("/").rsplit("/", 1)
+            entry = paramiko.SFTPAttributes()
+            entry.filename = nome
+            entry.st_size = int(tamanho)
+            entry.st_mtime = int(float(mtime))
+            entry.st_mode = (stat.S_IFDIR if tipo == "d" else stat.S_IFREG) | 0o755
+            indice.setdefault(pai or "/", []).append(entry)
+        if not raiz_encontrada:
+            raise RuntimeError("saída do find sem o diretório raiz")
+    except Exception as e:
+        logging.info("find remoto indisponível para %s (%s) – usando listagem por diretório.", remote_dir, e)
+        return None
+    return indice
+
+
+def percorrer_arquivos_sftp(
+    pool: PoolSFTP,
+    remote_dir: str,
+    *,
+    filtro_mtime: Tuple[int, int | None] | None = None,
+    pular_pastas_antigas: bool = False,
+    diretorios: Set[str] | None = None,
+    usar_find: bool = False,
+    tolerar_erros: bool = True,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Percorre recursivamente `remote_dir`, gerando (caminho_remoto, {'tamanho': int, 'mtime': int})
+    assim que cada diretório é listado: quem consome pode começar a trabalhar antes do fim da listagem.
+
+    Se `filtro_mtime` = (inicio, fim) for informado (epoch), inclui apenas arquivos com inicio <= mtime < fim
+    (fim None: sem limite superior). Com `pular_pastas_antigas`, pastas do nível 0 com mtime < inicio não são
+    percorridas (heurística simples).
+    Se `diretorios` for informado, acumula nele os diretórios encontrados (ver ensure_remote_dirs).
+    Falhas de conexão sempre interrompem a listagem; as demais falhas num diretório são registradas e a
+    subárvore é ignorada, exceto com `tolerar_erros=False` (listagem incompleta não é aceitável).
+    Se `remote_dir` não existir, a listagem é vazia.
+
+    A árvore é percorrida em largura com vários listdir_attr em voo ao mesmo tempo (um por conexão do pool),
+    em vez de um round trip serial por diretório. Com `usar_find`, tenta antes obter a árvore inteira
+    com um único `find` no servidor (listar_via_find).
+    """
+    inicio, fim = filtro_mtime or (None, None)
+    indice = None
+    if usar_find:
+        with pool.conexao() as conn:
+            indice = listar_via_find(conn.sftp, remote_dir)
+
+    def listar_diretorio(diretorio: str) -> List[paramiko.SFTPAttributes]:
+        if indice is not None:
+            return indice.get(diretorio.rstrip("/") or "/", [])
+        with pool.conexao() as conn:
+            return conn.executar(lambda s: s.listdir_attr(diretorio))
+
+    with ThreadPoolExecutor(max_workers=pool.tamanho) as executor:
+        pendentes = {executor.submit(listar_diretorio, remote_dir): (remote_dir, 0)}
+        while pendentes:
+            concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+            for futuro in concluidos:
+                diretorio, nivel = pendentes.pop(futuro)
+                try:
+                    entries = futuro.result()
+                    if diretorios is not None:
+                        diretorios.add(diretorio.rstrip("/") or "/")
+                    for entry in entries:
+                        nome = entry.filename
+                        caminho_remoto = f"{diretorio.rstrip('/')}/{nome}".replace("//", "/")
+                        is_dir = stat.S_ISDIR(entry.st_mode or 0)
+
+                        if is_dir:
+                            if nivel == 0 and pular_pastas_antigas and inicio is not None and entry.st_mtime < inicio:
+                                logging.info("Pulando pasta antiga (nível 0): %s", caminho_remoto)
+                                if diretorios is not None:
+                                    diretorios.add(caminho_remoto)
+                                continue
+                            pendentes[executor.submit(listar_diretorio, caminho_remoto)] = (caminho_remoto, nivel + 1)
+                        else:
+                            if (inicio is None or entry.st_mtime >= inicio) and (fim is None or entry.st_mtime < fim):
+                                yield caminho_remoto, {"tamanho": entry.st_size, "mtime": entry.st_mtime}
+                except (ErroConexaoSFTP, paramiko.SSHException) as e:
+                    logging.error("Erro de conexão ao listar %s: %s – abortando.", diretorio, e)
+                    raise
+                except Exception as e:
+                    if isinstance(e, FileNotFoundError) and diretorio == remote_dir:
+                        # Ainda não criado (ex.: primeira execução): não há arquivos, não é erro.
+                        logging.info("%s não existe – nada a listar.", diretorio)
+                    elif tolerar_erros:
+                        logging.error("Erro ao listar %s: %s", diretorio, e)
+                    else:
+                        logging.error("Erro ao listar %s: %s – abortando.", diretorio, e)
+                        raise
+
+
+def listar_arquivos_sftp_recursivo(
+    pool: PoolSFTP,
+    remote_dir: str,
+    *,
+    filtro_mtime: Tuple[int, int | None] | None = None,
+    pular_pastas_antigas: bool = False,
+    diretorios: Set[str] | None = None,
+    usar_find: bool = False,
+    remover_prefixo: str | None = None,
+    arquivos: Dict[str, Dict[str, Any]] | None = None,
+    tolerar_erros: bool = True,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Lista arquivos recursivamente a partir de `remote_dir` (ver percorrer_arquivos_sftp).
+
+    Retorna dict: { caminho_remoto: {'tamanho': int, 'mtime': int} }
+
+    Se `remover_prefixo` for informado, a chave é o caminho sem esse prefixo e o caminho completo vai em 'caminho'.
+    Se `arquivos` for informado, os resultados são gravados nele (sobrescrevendo chaves repetidas) e ele é retornado.
+    """
+    if arquivos is None:
+        arquivos = {}
+    for caminho, dados in percorrer_arquivos_sftp(
+        pool,
+        remote_dir,
+        filtro_mtime=filtro_mtime,
+        pular_pastas_antigas=pular_pastas_antigas,
+        diretorios=diretorios,
+        usar_find=usar_find,
+        tolerar_erros=tolerar_erros,
+    ):
+        if remover_prefixo is None:
+            arquivos[caminho] = dados
+        else:
+            dados["caminho"] = caminho
+            arquivos[caminho.removeprefix(remover_prefixo)] = dados
+    return arquivos
+
+
+def consultar_destino(pool: PoolSFTP, caminho: str) -> Dict[str, Any] | None:
+    """stat de um único arquivo, no formato da listagem ({'tamanho': int, 'mtime': int}); None se não existir."""
+    try:
+        with pool.conexao() as conn:
+            attrs = conn.executar(lambda s: s.stat(caminho))
+    except FileNotFoundError:
+        return None
+    return {"tamanho": attrs.st_size, "mtime": attrs.st_mtime}
+
+
+def ensure_remote_dirs(sftp: pysftp.Connection, remote_dir: str, conhecidos: Set[str] | None = None) -> None:
+    """
+    Garante que o diretório remoto exista (criando partes intermediárias).
+
+    Se `conhecidos` for informado (diretórios vistos na listagem do destino ou já criados nesta execução),
+    ele substitui as sondagens sftp.exists(): um diretório conhecido retorna sem round trip e, para os demais,
+    só os níveis abaixo do prefixo conhecido mais profundo recebem mkdir. Os criados entram no conjunto,
+    então os próximos arquivos na mesma pasta não repetem o trabalho.
+    """
+    remote_dir = remote_dir.replace("//", "/").rstrip("/") or "/"
+    if conhecidos is None:
+        if sftp.exists(remote_dir):
+            return
+        conhecidos = set()
+    elif remote_dir in conhecidos:
+        return
+
+    parts = remote_dir.strip("/").split("/")
+    prefixos = ["/" + "/".join(parts[: n + 1]) for n in range(len(parts))]
+    with _LOCK_DIRS_REMOTOS:
+        # Um prefixo conhecido implica que todos os seus ancestrais também existem.
+        inicio = 0
+        for n in range(len(prefixos) - 1, -1, -1):
+            if prefixos[n] in conhecidos:
+                inicio = n + 1
+                break
+        for path in prefixos[inicio:]:
+            try:
+                sftp.mkdir(path)
+            except IOError:
+                # Já existe (ex.: fora da listagem do destino).
+                if not sftp.exists(path):
+                    raise
+            conhecidos.add(path)
+
+
+class ErroLeituraOrigem(Exception):
+    """Falha ao abrir ou ler o arquivo na origem durante uma transferência."""
+
+
+class LeitorOrigem:
+    """
+    Objeto de leitura entregue ao putfo do destino: repassa os bytes lidos da origem e,
+    se `copia` for informado, grava os mesmos bytes localmente (tee); se `digest` for informado,
+    alimenta o hash com eles.
+    """
+
+    def __init__(self, fr: IO[bytes], copia: IO[bytes] | None = None, digest: Any = None) -> None:
+        self._fr = fr
+        self._copia = copia
+        self._digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            dados = self._fr.read(size)
+        except Exception as e:
+            raise ErroLeituraOrigem(e) from e
+        if self._copia is not None:
+            self._copia.write(dados)
+        if self._digest is not None:
+            self._digest.update(dados)
+        return dados
+
+
+def hash_remoto(sftp: pysftp.Connection, caminho: str) -> bytes | None:
+    """
+    SHA-256 de `caminho` calculado pelo próprio servidor (extensão SFTP check-file); None se não suportado.
+
+    Um servidor que recusa a extensão é lembrado e não é mais consultado nesta execução.
+    """
+    try:
+        servidor = sftp.sftp_client.get_channel().get_transport().getpeername()
+        if servidor in _CHECK_FILE_INDISPONIVEL:
+            return None
+        with sftp.open(caminho, "rb") as f:
+            try:
+                return f.check("sha256")
+            except IOError as e:
+                logging.info("check-file indisponível em %s (%s) – comparando só tamanhos.", servidor[0], e)
+                _CHECK_FILE_INDISPONIVEL.add(servidor)
+                return None
+    except Exception:
+        return None
+
+
+def conteudo_divergente(sftp_orig: pysftp.Connection, origem: str, sftp_dest: pysftp.Connection, destino: str) -> bool:
+    """
+    Compara os SHA-256 calculados pelos dois servidores, sem transferir o conteúdo.
+
+    Só retorna True quando os dois lados suportam check-file e os hashes diferem; caso contrário
+    prevalece a comparação por tamanho.
+    """
+    hash_orig = hash_remoto(sftp_orig, origem)
+    if hash_orig is None:
+        return False
+    hash_dest = hash_remoto(sftp_dest, destino)
+    return hash_dest is not None and hash_dest != hash_orig
+
+
+def enviar_em_pipeline(sftp: pysftp.Connection, leitor: LeitorOrigem, destino: str, bloco: int) -> None:
+    """
+    Equivalente ao putfo do paramiko, mas com WRITEs de `bloco` bytes (o putfo usa sempre o padrão de 32 KiB).
+    Confirma ao final, pelo tamanho, que o destino recebeu o arquivo inteiro.
+    """
+    with sftp.sftp_client.open(destino, "wb") as fw:
+        fw.set_pipelined(True)
+        fw.MAX_REQUEST_SIZE = bloco
+        enviados = 0
+        while True:
+            dados = leitor.read(bloco)
+            if not dados:
+                break
+            fw.write(dados)
+            enviados += len(dados)
+    recebido = sftp.sftp_client.stat(destino).st_size
+    if recebido != enviados:
+        raise IOError(f"{destino}: tamanho no destino {recebido} != {enviados}")
+
+
+def _confirmacao_scp(canal: paramiko.Channel) -> bytes:
+    """Lê a resposta do `scp -t`: b"\\0" (ok), b"" (canal encerrado) ou levanta IOError com a mensagem de erro."""
+    codigo = canal.recv(1)
+    if codigo in (b"\1", b"\2"):
+        mensagem = b""
+        while not mensagem.endswith(b"\n"):
+            parte = canal.recv(1)
+            if not parte:
+                break
+            mensagem += parte
+        raise IOError(mensagem.decode("utf-8", "replace").strip() or "scp recusou o arquivo")
+    return codigo
+
+
+class SessaoSCP:
+    """
+    Envio pelo protocolo SCP com um único `scp -r -t <raiz>` por conexão de destino: aberto num canal exec
+    no primeiro arquivo e reaproveitado pelos seguintes, sem canal nem processo novo por arquivo.
+    Cada arquivo é um registro C (cabeçalho e depois os bytes em fluxo contínuo, sem as confirmações
+    por WRITE do SFTP); a troca de pasta usa registros D/E.
+
+    Só faz sentido quando o caminho visto pelo SFTP é o mesmo do shell (sem chroot).
+    """
+
+    def __init__(self, raiz: str) -> None:
+        self.raiz = raiz.rstrip("/") or "/"
+        self._prefixo = raiz.rstrip("/") + "/"
+        self._canal: paramiko.Channel | None = None
+        self._pastas: List[str] = []  # pasta atual do scp, relativa à raiz
+
+    def enviar(self, sftp: pysftp.Connection, leitor: LeitorOrigem, destino: str, tamanho: int, bloco: int) -> bool:
+        """
+        Envia `destino` (abaixo da raiz) com `tamanho` bytes lidos de `leitor`.
+
+        Retorna False, sem ler nada de `leitor`, se o servidor não permitir exec, não tiver scp ou não responder
+        como `scp -t` (ex.: ForceCommand internal-sftp aceita o exec e fica em silêncio); o servidor é lembrado
+        e os próximos envios usam SFTP direto.
+        O SCP exige o tamanho antecipado: se a origem terminar antes ou ainda tiver dados depois de `tamanho` bytes,
+        o arquivo é recusado ao scp e ErroLeituraOrigem é levantada (quem chama remove o arquivo parcial).
+        """
+        *pastas, nome = destino.removeprefix(self._prefixo).split("/")
+        if not destino.startswith(self._prefixo) or any(p in ("", ".", "..") or "\n" in p for p in (*pastas, nome)):
+            return False
+        if self._canal is not None and self._canal.closed:
+            self.fechar()
+        if self._canal is None and not self._abrir(sftp):
+            return False
+
+        try:
+            self._entrar(pastas)
+            self._registro(f"C0644 {tamanho} {nome}")
+            enviados = 0
+            ultimo = b""
+            while enviados < tamanho:
+                dados = leitor.read(min(bloco, tamanho - enviados))
+                if not dados:
+                    raise ErroLeituraOrigem(IOError(f"origem terminou em {enviados} de {tamanho} bytes"))
+                if ultimo:
+                    self._canal.sendall(ultimo)
+                ultimo = dados
+                enviados += len(dados)
+            # Origem maior que o cabeçalho (cresceu desde a listagem): o scp é avisado e descarta o envio.
+            completo = not leitor.read(1)
+            # Último bloco e confirmação num único envio: um byte avulso esperaria pelo ACK atrasado do servidor (Nagle).
+            self._canal.sendall(ultimo + (b"\0" if completo else b"\1origem maior que o tamanho informado\n"))
+            if _confirmacao_scp(self._canal) != b"\0":
+                raise IOError(f"scp encerrado ao enviar {destino}")
+        except BaseException:
+            # Protocolo em estado desconhecido: o próximo arquivo abre outro scp.
+            self.fechar()
+            raise
+        if not completo:
+            raise ErroLeituraOrigem(IOError(f"origem maior que os {tamanho} bytes listados"))
+        return True
+
+    def _abrir(self, sftp: pysftp.Connection) -> bool:
+        transporte = sftp.sftp_client.get_channel().get_transport()
+        servidor = transporte.getpeername()
+        if servidor in _SCP_INDISPONIVEL:
+            return False
+        canal = None
+        try:
+            canal = transporte.open_session()
+            canal.settimeout(TIMEOUT_SCP_INICIO)
+            canal.exec_command(f"scp -r -t {shlex.quote(self.raiz)}")
+            disponivel = canal.recv(1) == b"\0"
+        except (paramiko.SSHException, OSError):  # inclui socket.timeout
+            disponivel = False
+        if not disponivel:
+            if canal is not None:
+                canal.close()
+            logging.info("scp indisponível em %s – enviando via SFTP.", servidor[0])
+            _SCP_INDISPONIVEL.add(servidor)
+            return False
+        canal.settimeout(TIMEOUT_SCP_REMOTO)
+        self._canal = canal
+        self._pastas = []
+        return True
+
+    def _entrar(self, pastas: List[str]) -> None:
+        """Leva o scp da pasta atual para `pastas`: E sobe um nível, D entra (criando a pasta se preciso)."""
+        comum = 0
+        while comum < min(len(pastas), len(self._pastas)) and pastas[comum] == self._pastas[comum]:
+            comum += 1
+        while len(self._pastas) > comum:
+            self._registro("E")
+            self._pastas.pop()
+        for pasta in pastas[comum:]:
+            self._registro(f"D0755 0 {pasta}")
+            self._pastas.append(pasta)
+
+    def _registro(self, linha: str) -> None:
+        self._canal.sendall(linha.encode("utf-8") + b"\n")
+        if _confirmacao_scp(self._canal) != b"\0":
+            raise IOError(f"scp encerrado após {linha!r}")
+
+    def fechar(self) -> None:
+        if self._canal is not None:
+            self._canal.close()
+            self._canal = None
+        self._pastas = []
+
+
+def transferir_arquivo(
+    sftp_orig: pysftp.Connection,
+    sftp_dest: pysftp.Connection,
+    remoto: str,
+    destino: str,
+    tamanho: int,
+    *,
+    copia_local: Path | None = None,
+    verificar_hash: bool = False,
+    limites_orig: LimitesSFTP = LimitesSFTP(),
+    limites_dest: LimitesSFTP = LimitesSFTP(),
+    scp: SessaoSCP | None = None,
+) -> None:
+    """
+    Copia `remoto` (origem) para `destino` sem passar pelo disco local.
+
+    O arquivo de origem é lido com prefetch (até JANELA_PREFETCH bytes em voo) e gravado no destino
+    com WRITEs em pipeline; download e upload se sobrepõem. O tamanho de cada READ/WRITE segue os
+    limites anunciados por cada servidor (`limites_orig` / `limites_dest`). Com `scp`, o envio é feito
+    pelo `scp -t` da conexão de destino quando o servidor permitir (ver SessaoSCP).
+    Se `copia_local` for informado, os bytes também são gravados localmente durante a leitura (sem novo download),
+    em um arquivo .part que é renomeado para `copia_local` quando a origem foi lida por inteiro. A cópia só depende
+    da origem: se o destino falhar, o restante da origem é lido para a cópia antes de a falha ser levantada.
+    Com `verificar_hash`, o SHA-256 é calculado durante o streaming e comparado ao check-file do destino
+    (quando suportado), detectando envios truncados ou corrompidos.
+
+    Falhas do lado da origem são levantadas como ErroLeituraOrigem e o arquivo parcial no destino é removido.
+    """
+    try:
+        fr = sftp_orig.open(remoto, "rb")
+    except Exception as e:
+        raise ErroLeituraOrigem(e) from e
+
+    parcial = copia_local.with_name(copia_local.name + ".part") if copia_local is not None else None
+    erro_destino: Exception | None = None
+    try:
+        with fr:
+            # Atributo de instância: não altera o padrão da classe, usado pelas conexões com o outro servidor.
+            fr.MAX_REQUEST_SIZE = limites_orig.max_leitura
+            pendentes = min(MAX_LEITURAS_PENDENTES, max(1, JANELA_PREFETCH // limites_orig.max_leitura))
+            try:
+                fr.prefetch(tamanho, max_concurrent_requests=pendentes)
+            except TypeError:  # paramiko < 3.3 não limita o número de requisições
+                fr.prefetch(tamanho)
+
+            digest = hashlib.sha256() if verificar_hash else None
+            with open(parcial, "wb") if parcial is not None else nullcontext() as copia:
+                leitor = LeitorOrigem(fr, copia, digest)
+                try:
+                    if not (scp is not None and scp.enviar(sftp_dest, leitor, destino, tamanho, limites_dest.max_escrita)):
+                        enviar_em_pipeline(sftp_dest, leitor, destino, limites_dest.max_escrita)
+                except ErroLeituraOrigem:
+                    # Não deixa um arquivo truncado no destino.
+                    try:
+                        sftp_dest.remove(destino)
+                    except Exception:
+                        pass
+                    raise
+                except Exception as e:
+                    if copia is None:
+                        raise
+                    # Falha do lado do destino: termina de ler a origem para a cópia local.
+                    erro_destino = e
+                    while leitor.read(limites_orig.max_leitura):
+                        pass
+
+        if erro_destino is None and digest is not None:
+            hash_dest = hash_remoto(sftp_dest, destino)
+            if hash_dest is not None and hash_dest != digest.digest():
+                erro_destino = IOError(f"SHA-256 divergente após o envio de {destino}")
+    except BaseException:
+        # Só falhas da origem (ou interrupções) descartam a cópia local.
+        if parcial is not None:
+            parcial.unlink(missing_ok=True)
+        raise
+
+    if parcial is not None:
+        # Só metadados: a cópia local aparece completa, de uma vez.
+        os.replace(parcial, copia_local)
+    if erro_destino is not None:
+        raise erro_destino